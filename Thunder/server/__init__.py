@@ -1,10 +1,11 @@
 # Thunder/server/__init__.py
 
 from aiohttp import web
-from .stream_routes import routes
+from .stream_routes import init_streamers, routes
 
 
 async def web_server():
+    init_streamers()
     web_app = web.Application(client_max_size=50 * 1024 * 1024)
     web_app.add_routes(routes)
     return web_app
@@ -1,17 +1,27 @@
 
 # Thunder/server/stream_routes.py
 
+import asyncio
+import heapq
+import itertools
 import re
 import secrets
+import socket
+import string
 import time
+from collections import OrderedDict
+from contextlib import aclosing
+from functools import lru_cache
+from typing import AsyncGenerator
 from urllib.parse import quote, unquote
 
 from aiohttp import web
+from multidict import CIMultiDict
 
 from Thunder import __version__, StartTime
 from Thunder.bot import StreamBot, multi_clients, work_loads
 from Thunder.server.exceptions import FileNotFound, InvalidHash
-from Thunder.utils.custom_dl import ByteStreamer
+from Thunder.utils.custom_dl import CHUNK_SIZE, ByteStreamer, FileInfo
 from Thunder.utils.logger import logger
 from Thunder.utils.render_template import render_page
 from Thunder.utils.time_format import get_readable_time
@@ -19,13 +29,17 @@ from Thunder.utils.time_format import get_readable_time
 routes = web.RouteTableDef()
 
 SECURE_HASH_LENGTH = 6
-CHUNK_SIZE = 1024 * 1024
-MAX_CONCURRENT_PER_CLIENT = 8
+PARSE_CACHE_SIZE = 4096
+MAX_PATH_LENGTH = 2048
+FILE_INFO_CACHE_SIZE = 1024
+FILE_INFO_CACHE_TTL = 300
+STREAM_QUEUE_SIZE = 4
+LARGE_RANGE_SIZE = 16 * CHUNK_SIZE
 RANGE_REGEX = re.compile(r"bytes=(?P<start>\d*)-(?P<end>\d*)")
-PATTERN_HASH_FIRST = re.compile(
-    rf"^([a-zA-Z0-9_-]{{{SECURE_HASH_LENGTH}}})(\d+)(?:/.*)?$")
-PATTERN_ID_FIRST = re.compile(r"^(\d+)(?:/.*)?$")
-VALID_HASH_REGEX = re.compile(r'^[a-zA-Z0-9_-]+$')
+PATTERN_MEDIA_PATH = re.compile(
+    rf"(?:(?P<hash>[a-zA-Z0-9_-]{{{SECURE_HASH_LENGTH}}})(?P<hash_id>\d+)|(?P<id>\d+))(?:/.*)?")
+HASH_CHARS = frozenset(string.ascii_letters + string.digits + "_-")
+PATH_START_CHARS = HASH_CHARS | {"/", "%"}
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -34,55 +48,212 @@ CORS_HEADERS = {
     "Access-Control-Expose-Headers": "Content-Length, Content-Range, Content-Disposition",
 }
 
-streamers = {}
+BASE_RESPONSE_HEADERS = CIMultiDict({
+    "Accept-Ranges": "bytes",
+    "Cache-Control": "no-store",
+    "Access-Control-Allow-Origin": "*",
+})
+
+streamers: tuple[ByteStreamer, ...] = ()
+client_index: dict[int, int] = {}
+
+_client_load: dict[int, int] = {}
+_client_heap: list[tuple[int, int, int]] = []
+_heap_counter = itertools.count()
+
+file_info_cache: OrderedDict[int, tuple[float, FileInfo]] = OrderedDict()
+
+_client_ready: dict[int, bool] = {}
+_client_locks: dict[int, asyncio.Lock] = {}
 
 
 # ---------------- HELPERS ----------------
 
-def get_streamer(client_id: int) -> ByteStreamer:
-    if client_id not in streamers:
-        streamers[client_id] = ByteStreamer(multi_clients[client_id])
-    return streamers[client_id]
+def init_streamers() -> None:
+    global streamers, client_index
+    client_ids = tuple(sorted(multi_clients))
+    streamers = tuple(ByteStreamer(multi_clients[cid]) for cid in client_ids)
+    client_index = {cid: index for index, cid in enumerate(client_ids)}
+
+
+def is_valid_hash(value: str) -> bool:
+    return HASH_CHARS.issuperset(value)
 
 
 def parse_media_request(path: str, query: dict) -> tuple[int, str]:
-    clean_path = unquote(path).strip('/')
+    if len(path) > MAX_PATH_LENGTH or path[0] not in PATH_START_CHARS:
+        raise InvalidHash("Invalid URL")
+    return _parse_media_path(path, query.get("hash", ""))
 
-    match = PATTERN_HASH_FIRST.match(clean_path)
-    if match:
-        return int(match.group(2)), match.group(1)
 
-    match = PATTERN_ID_FIRST.match(clean_path)
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_media_path(path: str, query_hash: str) -> tuple[int, str]:
+    clean_path = unquote(path).strip('/')
+
+    end = clean_path.find('/')
+    head = clean_path if end == -1 else clean_path[:end]
+    if len(head) > SECURE_HASH_LENGTH:
+        id_part = head[SECURE_HASH_LENGTH:]
+        secure_hash = head[:SECURE_HASH_LENGTH]
+        if id_part.isdecimal() and is_valid_hash(secure_hash):
+            return int(id_part), secure_hash
+    if head.isdecimal():
+        return int(head), query_hash.strip()
+
+    match = PATTERN_MEDIA_PATH.fullmatch(clean_path)
     if match:
-        return int(match.group(1)), query.get("hash", "").strip()
+        if match.group("hash"):
+            return int(match.group("hash_id")), match.group("hash")
+        return int(match.group("id")), query_hash.strip()
 
     raise InvalidHash("Invalid URL")
 
 
+def _push_client(client_id: int) -> None:
+    if len(_client_heap) > 4 * len(_client_load) + 16:
+        _client_heap[:] = [
+            (load, next(_heap_counter), cid) for cid, load in _client_load.items()
+        ]
+        heapq.heapify(_client_heap)
+        return
+    heapq.heappush(_client_heap, (_client_load[client_id], next(_heap_counter), client_id))
+
+
+def adjust_client_load(client_id: int, delta: int) -> None:
+    work_loads[client_id] += delta
+    _client_load[client_id] = work_loads[client_id]
+    _push_client(client_id)
+
+
 def select_optimal_client() -> tuple[int, ByteStreamer]:
     if not work_loads:
         raise web.HTTPInternalServerError(text="No clients available")
 
-    available = [
-        (cid, load) for cid, load in work_loads.items()
-        if load < MAX_CONCURRENT_PER_CLIENT
-    ]
+    if len(_client_load) != len(work_loads):
+        for cid, load in work_loads.items():
+            if cid not in _client_load:
+                _client_load[cid] = load
+                _push_client(cid)
+
+    # Entries are never removed on update; skip the ones whose load is stale.
+    while True:
+        load, _, client_id = _client_heap[0]
+        if _client_load.get(client_id) == load:
+            break
+        heapq.heappop(_client_heap)
+
+    return client_id, streamers[client_index[client_id]]
+
+
+class ClientSlot:
+    __slots__ = ('client_id',)
+
+    def __init__(self, client_id: int) -> None:
+        self.client_id = client_id
+
+    def __enter__(self) -> "ClientSlot":
+        adjust_client_load(self.client_id, 1)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        adjust_client_load(self.client_id, -1)
+
+
+def set_tcp_nodelay(request: web.Request, enabled: bool) -> None:
+    transport = request.transport
+    sock = transport.get_extra_info("socket") if transport else None
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(enabled))
+    except OSError:
+        pass
+
+
+async def ensure_client_ready(client_id: int, streamer: ByteStreamer) -> None:
+    if _client_ready.get(client_id):
+        return
+    async with _client_locks.setdefault(client_id, asyncio.Lock()):
+        if not streamer.client.is_connected:
+            await streamer.client.start()
+        _client_ready[client_id] = True
+
+
+async def get_cached_file_info(streamer: ByteStreamer, message_id: int) -> FileInfo:
+    now = time.monotonic()
+    cached = file_info_cache.get(message_id)
+    if cached and now - cached[0] < FILE_INFO_CACHE_TTL:
+        file_info_cache.move_to_end(message_id)
+        return cached[1]
 
-    client_id = min(available, key=lambda x: x[1])[0] if available else min(work_loads, key=work_loads.get)
-    return client_id, get_streamer(client_id)
+    file_info = await streamer.get_file_info(message_id)
+    if not file_info.unique_id:
+        return file_info
+
+    filename = file_info.file_name or f"file_{secrets.token_hex(4)}"
+    file_info.content_type = file_info.mime_type or "application/octet-stream"
+    file_info.content_disposition = f"inline; filename*=UTF-8''{quote(filename)}"
+
+    file_info_cache[message_id] = (now, file_info)
+    if len(file_info_cache) > FILE_INFO_CACHE_SIZE:
+        file_info_cache.popitem(last=False)
+    return file_info
+
+
+async def _produce_chunks(chunks: AsyncGenerator[bytes, None], queue: asyncio.Queue) -> None:
+    try:
+        async for chunk in chunks:
+            await queue.put(chunk)
+    except Exception as e:
+        await queue.put(e)
+    else:
+        await queue.put(None)
+    finally:
+        await chunks.aclose()
+
+
+async def prefetch_chunks(
+    chunks: AsyncGenerator[bytes, None], queue_size: int = STREAM_QUEUE_SIZE
+) -> AsyncGenerator[bytes, None]:
+    # Telegram is read by a separate task into a bounded queue, so the next
+    # chunk downloads while the current one is written to the client.
+    queue = asyncio.Queue(maxsize=queue_size)
+    producer = asyncio.create_task(_produce_chunks(chunks, queue))
+
+    try:
+        while (item := await queue.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Wait for the Telegram download to stop before the caller releases its
+        # client slot, so work_loads reflects transfers that are really running.
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
 
 
 def parse_range_header(range_header: str, file_size: int) -> tuple[int, int]:
     if not range_header:
         return 0, file_size - 1
 
-    match = RANGE_REGEX.match(range_header)
-    if not match:
+    if not range_header.startswith("bytes="):
         raise web.HTTPBadRequest()
 
-    start = int(match.group("start") or 0)
-    end = int(match.group("end") or file_size - 1)
-    return start, min(end, file_size - 1)
+    start_text, sep, end_text = range_header[6:].partition("-")
+    if not (sep and (not start_text or start_text.isdecimal())
+            and (not end_text or end_text.isdecimal())):
+        # Multi-range and other unusual forms keep the regex's first-range behaviour.
+        match = RANGE_REGEX.match(range_header)
+        if not match:
+            raise web.HTTPBadRequest()
+        start_text, end_text = match.group("start"), match.group("end")
+
+    start = int(start_text) if start_text else 0
+    end = min(int(end_text), file_size - 1) if end_text else file_size - 1
+    if start > end:
+        raise web.HTTPRequestRangeNotSatisfiable(
+            headers={"Content-Range": f"bytes */{file_size}"})
+    return start, end
 
 
 # ---------------- ROUTES ----------------
@@ -117,7 +288,10 @@ async def options_handler(request):
 @routes.get(r"/watch/{path:.+}")
 async def media_preview(request: web.Request):
     path = request.match_info["path"]
-    message_id, secure_hash = parse_media_request(path, request.query)
+    try:
+        message_id, secure_hash = parse_media_request(path, request.query)
+    except InvalidHash:
+        raise web.HTTPNotFound(text="Link expired or invalid")
 
     html = await render_page(message_id, secure_hash, requested_action="stream")
     return web.Response(
@@ -137,62 +311,88 @@ async def media_delivery(request: web.Request):
         raise web.HTTPMethodNotAllowed("HEAD", ["GET"])
 
     path = request.match_info["path"]
-    message_id, secure_hash = parse_media_request(path, request.query)
-
-    client_id, streamer = select_optimal_client()
-    work_loads[client_id] += 1
-
     try:
-        # 🔄 AUTO REFRESH CLIENT (replaces /restart)
-        if not streamer.client.is_connected:
-            await streamer.client.start()
-
-        file_info = await streamer.get_file_info(message_id)
-
-        if not file_info or not file_info.get("unique_id"):
-            raise FileNotFound("File not found")
-
-        if file_info["unique_id"][:SECURE_HASH_LENGTH] != secure_hash:
-            raise InvalidHash("Hash mismatch")
-
-        file_size = file_info.get("file_size", 0)
-        if file_size <= 0:
-            raise FileNotFound("Invalid file size")
-
-        range_header = request.headers.get("Range")
-        start, end = parse_range_header(range_header, file_size)
-        content_length = end - start + 1
-
-        mime = file_info.get("mime_type", "application/octet-stream")
-        filename = file_info.get("file_name") or f"file_{secrets.token_hex(4)}"
-
-        headers = {
-            "Content-Type": mime,
-            "Content-Disposition": f"inline; filename*=UTF-8''{quote(filename)}",
-            "Accept-Ranges": "bytes",
-            "Cache-Control": "no-store",
-            "Access-Control-Allow-Origin": "*",
-            "Content-Range": f"bytes {start}-{end}/{file_size}"
-        }
+        message_id, secure_hash = parse_media_request(path, request.query)
+    except InvalidHash:
+        raise web.HTTPNotFound(text="Link expired or invalid")
 
-        async def stream_generator():
-            try:
-                async for chunk in streamer.stream_file(
-                    message_id,
-                    offset=start,
-                    limit=content_length
-                ):
-                    yield chunk
-            finally:
-                work_loads[client_id] -= 1
-
-        return web.Response(
-            status=206,
-            body=stream_generator(),
-            headers=headers
-        )
+    client_id, streamer = select_optimal_client()
 
-    except Exception as e:
-        work_loads[client_id] -= 1
-        logger.error(f"Stream error: {e}", exc_info=True)
-        raise web.HTTPNotFound(text="Link expired or invalid")
+    response = None
+    with ClientSlot(client_id):
+        try:
+            # 🔄 AUTO REFRESH CLIENT (replaces /restart)
+            await ensure_client_ready(client_id, streamer)
+
+            file_info = await get_cached_file_info(streamer, message_id)
+
+            if not file_info.unique_id:
+                raise FileNotFound("File not found")
+
+            if file_info.unique_id[:SECURE_HASH_LENGTH] != secure_hash:
+                raise InvalidHash("Hash mismatch")
+
+            file_size = file_info.file_size
+            if file_size <= 0:
+                raise FileNotFound("Invalid file size")
+
+            range_header = request.headers.get("Range")
+            start, end = parse_range_header(range_header, file_size)
+            content_length = end - start + 1
+
+            headers = BASE_RESPONSE_HEADERS.copy()
+            headers["Content-Type"] = file_info.content_type
+            headers["Content-Disposition"] = file_info.content_disposition
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+
+            response = web.StreamResponse(status=206, headers=headers)
+            response.content_length = content_length
+            # aiohttp turns TCP_NODELAY on; let the kernel pack segments while the
+            # body streams, then restore it for later requests on this connection.
+            set_tcp_nodelay(request, False)
+            await response.prepare(request)
+
+            # Telegram serves at most CHUNK_SIZE per request, so large ranges get a
+            # deeper read-ahead instead of bigger chunks; short seeks stay shallow.
+            queue_size = STREAM_QUEUE_SIZE if content_length >= LARGE_RANGE_SIZE else 1
+            chunks = prefetch_chunks(streamer.stream_file(
+                message_id,
+                offset=start,
+                limit=content_length
+            ), queue_size)
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    await response.write(chunk)
+
+            await response.write_eof()
+            return response
+
+        except ConnectionError as e:
+            # Telegram connection errors and client disconnects both land here;
+            # either way the next request re-checks this client under its lock.
+            _client_ready[client_id] = False
+            if isinstance(e, ConnectionResetError):
+                raise
+            logger.error(f"Stream connection error: {e}", exc_info=True)
+            if response is not None and response.prepared:
+                raise
+            raise web.HTTPServiceUnavailable()
+
+        except (InvalidHash, FileNotFound) as e:
+            logger.debug(f"Stream rejected for message {message_id}: {e}")
+            if response is not None and response.prepared:
+                raise
+            raise web.HTTPNotFound(text="Link expired or invalid")
+
+        except web.HTTPException:
+            raise
+
+        except Exception as e:
+            logger.error(f"Stream error: {e}", exc_info=True)
+            if response is not None and response.prepared:
+                raise
+            raise web.HTTPInternalServerError()
+
+        finally:
+            if response is not None:
+                set_tcp_nodelay(request, True)
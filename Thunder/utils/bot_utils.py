@@ -19,6 +19,8 @@ from Thunder.utils.messages import (MSG_BUTTON_GET_HELP, MSG_DC_UNKNOWN,
 from Thunder.utils.shortener import shorten
 from Thunder.vars import Var
 
+DOWNLOAD_URL_PREFIX = Var.URL.rstrip("/") + "/"
+STREAM_URL_PREFIX = DOWNLOAD_URL_PREFIX + "watch/"
 
 
 async def notify_ch(cli: Client, txt: str):
@@ -79,15 +81,14 @@ async def log_newusr(cli: Client, uid: int, fname: str):
 
 
 async def gen_links(fwd_msg: Message, shortener: bool = True) -> Dict[str, str]:
-    base_url = Var.URL.rstrip("/")
     fid = fwd_msg.id
     m_name_raw = get_fname(fwd_msg)
     m_name = m_name_raw.decode('utf-8', errors='replace') if isinstance(m_name_raw, bytes) else str(m_name_raw)
     m_size_hr = humanbytes(get_fsize(fwd_msg))
     enc_fname = quote(m_name)
     f_hash = get_hash(fwd_msg)
-    slink = f"{base_url}/watch/{f_hash}{fid}/{enc_fname}"
-    olink = f"{base_url}/{f_hash}{fid}/{enc_fname}"
+    slink = f"{STREAM_URL_PREFIX}{f_hash}{fid}/{enc_fname}"
+    olink = f"{DOWNLOAD_URL_PREFIX}{f_hash}{fid}/{enc_fname}"
     
     if shortener and getattr(Var, "SHORTEN_MEDIA_LINKS", False):
         try:
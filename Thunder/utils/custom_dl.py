@@ -1,7 +1,8 @@
 # Thunder/utils/custom_dl.py
 
 import asyncio
-from typing import Any, AsyncGenerator, Dict
+from contextlib import aclosing
+from typing import AsyncGenerator, Optional, Union
 
 from pyrogram import Client
 from pyrogram.errors import FloodWait
@@ -12,6 +13,35 @@ from Thunder.utils.file_properties import get_media
 from Thunder.utils.logger import logger
 from Thunder.vars import Var
 
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileInfo:
+    __slots__ = (
+        'message_id', 'file_size', 'file_name', 'mime_type', 'unique_id',
+        'media_type', 'error', 'content_type', 'content_disposition'
+    )
+
+    def __init__(
+        self,
+        message_id: int,
+        file_size: int = 0,
+        file_name: Optional[str] = None,
+        mime_type: Optional[str] = None,
+        unique_id: Optional[str] = None,
+        media_type: Optional[str] = None,
+        error: Optional[str] = None
+    ) -> None:
+        self.message_id = message_id
+        self.file_size = file_size
+        self.file_name = file_name
+        self.mime_type = mime_type
+        self.unique_id = unique_id
+        self.media_type = media_type
+        self.error = error
+        self.content_type: Optional[str] = None
+        self.content_disposition: Optional[str] = None
+
 
 class ByteStreamer:
     __slots__ = ('client', 'chat_id')
@@ -28,6 +58,8 @@ class ByteStreamer:
             except FloodWait as e:
                 logger.debug(f"FloodWait: get_message, sleep {e.value}s")
                 await asyncio.sleep(e.value)
+            except ConnectionError:
+                raise
             except Exception as e:
                 logger.debug(f"Error fetching message {message_id}: {e}", exc_info=True)
                 raise FileNotFound(f"Message {message_id} not found") from e
@@ -38,30 +70,51 @@ class ByteStreamer:
 
     async def stream_file(
         self, message_id: int, offset: int = 0, limit: int = 0
-    ) -> AsyncGenerator[bytes, None]:
+    ) -> AsyncGenerator[Union[bytes, memoryview], None]:
         message = await self.get_message(message_id)
 
-        chunk_offset = offset // (1024 * 1024)
+        chunk_offset = offset // CHUNK_SIZE
+        skip = offset - chunk_offset * CHUNK_SIZE
+        remaining = limit
 
         chunk_limit = 0
         if limit > 0:
-            chunk_limit = ((limit + (1024 * 1024) - 1) // (1024 * 1024)) + 1
+            chunk_limit = (skip + limit + CHUNK_SIZE - 1) // CHUNK_SIZE
 
         while True:
             try:
-                async for chunk in self.client.stream_media(
+                media_chunks = self.client.stream_media(
                     message, offset=chunk_offset, limit=chunk_limit
-                ):
-                    yield chunk
+                )
+                async with aclosing(media_chunks):
+                    async for chunk in media_chunks:
+                        chunk_offset += 1
+                        if chunk_limit:
+                            chunk_limit -= 1
+
+                        # Only the edge chunks of a range need trimming; slice them
+                        # through a memoryview so the payload is not copied.
+                        if skip or (limit > 0 and len(chunk) - skip > remaining):
+                            chunk = memoryview(chunk)[skip:]
+                            skip = 0
+                            if limit > 0:
+                                chunk = chunk[:remaining]
+
+                        yield chunk
+
+                        if limit > 0:
+                            remaining -= len(chunk)
+                            if remaining <= 0:
+                                return
                 break
             except FloodWait as e:
                 logger.debug(f"FloodWait: stream_file, sleep {e.value}s")
                 await asyncio.sleep(e.value)
 
-    def get_file_info_sync(self, message: Message) -> Dict[str, Any]:
+    def get_file_info_sync(self, message: Message) -> FileInfo:
         media = get_media(message)
         if not media:
-            return {"message_id": message.id, "error": "No media"}
+            return FileInfo(message.id, error="No media")
 
         media_type = type(media).__name__.lower()
         file_name = getattr(media, 'file_name', None)
@@ -88,19 +141,21 @@ class ByteStreamer:
             }
             mime_type = mime_map.get(media_type)
 
-        return {
-            "message_id": message.id,
-            "file_size": getattr(media, 'file_size', 0) or 0,
-            "file_name": file_name,
-            "mime_type": mime_type,
-            "unique_id": getattr(media, 'file_unique_id', None),
-            "media_type": media_type
-        }
+        return FileInfo(
+            message.id,
+            file_size=getattr(media, 'file_size', 0) or 0,
+            file_name=file_name,
+            mime_type=mime_type,
+            unique_id=getattr(media, 'file_unique_id', None),
+            media_type=media_type
+        )
 
-    async def get_file_info(self, message_id: int) -> Dict[str, Any]:
+    async def get_file_info(self, message_id: int) -> FileInfo:
         try:
             message = await self.get_message(message_id)
             return self.get_file_info_sync(message)
+        except ConnectionError:
+            raise
         except Exception as e:
             logger.debug(f"Error getting file info for {message_id}: {e}", exc_info=True)
-            return {"message_id": message_id, "error": str(e)}
+            return FileInfo(message_id, error=str(e))